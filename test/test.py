@@ -5,6 +5,7 @@ import requests
 import sys
 import time
 
+from bs4 import BeautifulSoup
 from cache import BaseCache
 from couchpotato.core.event import fireEvent
 from couchpotato.core.logger import CPLog
@@ -121,6 +122,14 @@ class TestPotatoYGG:
         assert nzb['description'] is not None
         assert not ygg.extraCheck(nzb)
 
+    def test_extraCheckOffline(self):
+        ygg = self.setUp()
+        assert ygg.extraCheck({})
+        assert ygg.extraCheck({'description': ''})
+        assert ygg.extraCheck({'description': 'A movie: tt0258463'})
+        assert ygg.extraCheck({'description': 'tt0258463 and tt0258463'})
+        assert not ygg.extraCheck({'description': 'tt0258463 vs tt0120737'})
+
     def test_moreInfo(self):
         ygg = self.setUp()
         assert ygg.login()
@@ -177,6 +186,37 @@ class TestPotatoYGG:
         fireEvent('setting.save.ygg.url.after')
         assert ygg.urls['torrent'] == 'https://test.com/torrent'
 
+    def test_parseInt(self):
+        soup = BeautifulSoup('<td>42</td>', 'html.parser')
+        assert YGG.parseInt(soup.td) == 42
+        soup = BeautifulSoup('<td> 42 </td>', 'html.parser')
+        assert YGG.parseInt(soup.td) == 42
+        soup = BeautifulSoup('<td><span>42</span></td>', 'html.parser')
+        assert YGG.parseInt(soup.td) == 42
+        soup = BeautifulSoup('<td></td>', 'html.parser')
+        assert YGG.parseInt(soup.td) == 0
+
+    def test_cachedGet(self):
+        ygg = self.setUp()
+        calls = []
+
+        def fake(url):
+            calls.append(url)
+            return '<html></html>'
+
+        ygg.getHTMLData = fake
+        url = 'https://test.com/engine/search?name=test'
+        assert ygg._cachedGet(url) == '<html></html>'
+        assert ygg._cachedGet(url) == '<html></html>'
+        assert len(calls) == 1  # Second call served from the cache
+        ygg.http_cache[(url, ygg.auth_epoch)] = (time.time() - YGG.cache_ttl,
+                                                 '<html></html>')
+        ygg._cachedGet(url)
+        assert len(calls) == 2  # Expired entry is fetched again
+        ygg.loginSuccess('')
+        ygg._cachedGet(url)
+        assert len(calls) == 3  # A new session invalidates the cache
+
     def test_login_url(self):
         ygg = self.setUp()
         assert ygg.urls['login'] is not None
@@ -1,8 +1,12 @@
 # coding: utf-8
+import logging
 import re
+import threading
+import time
 import traceback
 
-from bs4 import BeautifulSoup
+from bs4 import BeautifulSoup, SoupStrainer
+from collections import OrderedDict
 from couchpotato.core.event import addEvent
 from couchpotato.core.helpers.encoding import simplifyString, tryUrlencode
 from couchpotato.core.helpers.variable import getImdb, tryInt
@@ -13,6 +17,22 @@ from datetime import datetime
 
 log = CPLog(__name__)
 
+try:
+    import lxml  # noqa
+    HTML_PARSER = 'lxml'
+except ImportError:
+    HTML_PARSER = 'html.parser'
+
+try:
+    from concurrent.futures import ThreadPoolExecutor
+except ImportError:  # Python 2 without the futures backport
+    ThreadPoolExecutor = None
+
+# Only the results table and the pagination are consulted on a search
+# page, don't waste time building a tree for the rest of it
+SEARCH_STRAINER = SoupStrainer(['table', 'ul'],
+                               class_=['results', 'pagination'])
+
 
 class YGG(TorrentProvider, MovieProvider):
     """
@@ -23,7 +43,14 @@ class YGG(TorrentProvider, MovieProvider):
 
     limit = 50
     http_time_between_calls = 0
-    url_regexp = '^(https://[^/\s]+)/?'
+    url_regexp = re.compile('^(https://[^/\s]+)/?')
+    id_regexp = re.compile('/(\d+)-[^/\s]+$')
+    logout_regexp = re.compile('/user/logout')
+    imdb_regexp = re.compile('tt\d{7,8}')
+    category_regexp = re.compile(u'/filmvidéo/(film|animation|documentaire)/')
+    cache_size = 256
+    cache_ttl = 600  # In seconds
+    query_cache_size = 128
     urls = {}
 
     def __init__(self):
@@ -34,21 +61,60 @@ class YGG(TorrentProvider, MovieProvider):
         MovieProvider.__init__(self)
         addEvent('setting.save.ygg.url.after', self.refreshUrls)
         addEvent('setting.save.ygg.login_url.after', self.refreshLoginUrl)
+        self.http_cache = OrderedDict()
+        self.http_cache_lock = threading.Lock()
+        self.auth_epoch = 0
+        self.query_cache = OrderedDict()
         self.refreshUrls()
         self.refreshLoginUrl()
-        self.size_gb.append('go')
-        self.size_mb.append('mo')
-        self.size_kb.append('ko')
+        # Rebuild as instance level sets so repeated instantiations
+        # don't keep appending to the shared class level lists
+        self.size_gb = set(self.size_gb) | {'go'}
+        self.size_mb = set(self.size_mb) | {'mo'}
+        self.size_kb = set(self.size_kb) | {'ko'}
 
     @staticmethod
-    def parseText(node):
+    def parseInt(node):
+        """
+        Retrieve the integer content from a HTML node. Fast path for
+        cells holding a single text node, as seeders and leechers do.
+
+        :return: Integer content of a HTML node
+        :rtype: int
+        """
+        text = node.string
+        if text is not None:
+            text = text.strip()
+            if text.isdigit():
+                return int(text)
+        return tryInt(node.get_text(strip=True))
+
+    def _cachedGet(self, url):
         """
-        Retrieve the text content from a HTML node.
+        Fetch an url through getHTMLData with a small LRU cache, so
+        repeated searches and paginated refreshes don't re-issue
+        identical requests. Entries expire after cache_ttl seconds
+        and the whole cache is invalidated whenever urls or
+        credentials are refreshed.
 
-        :return: Text content of a HTML node
+        :param url: Url to fetch
+        :type url: str
+        :return: HTML body of the response
         :rtype: str
         """
-        return node.getText().strip()
+        key = (url, self.auth_epoch)
+        with self.http_cache_lock:
+            entry = self.http_cache.pop(key, None)
+            if entry and time.time() - entry[0] < YGG.cache_ttl:
+                self.http_cache[key] = entry
+                log.debug('Cache hit for {}'.format(url))
+                return entry[1]
+        data = self.getHTMLData(url)
+        with self.http_cache_lock:
+            self.http_cache[key] = (time.time(), data)
+            while len(self.http_cache) > YGG.cache_size:
+                self.http_cache.popitem(last=False)
+        return data
 
     def refreshUrls(self):
         """
@@ -56,7 +122,8 @@ class YGG(TorrentProvider, MovieProvider):
         http is not secure enough to use basic authentication.
         """
         self.last_login_check = False
-        matcher = re.search(YGG.url_regexp, self.conf('url'))
+        self.auth_epoch += 1
+        matcher = YGG.url_regexp.search(self.conf('url'))
         if matcher:
             url = matcher.group(1)
             log.debug('Refreshing provider\'s urls with {}'.format(url))
@@ -64,11 +131,20 @@ class YGG(TorrentProvider, MovieProvider):
             self.urls['search'] = url + '/engine/search?{}'
             self.urls['torrent'] = url + '/torrent'
             self.urls['url'] = url + '/engine/download_torrent?id={}'
+            self.torrent_href_regexp = re.compile('^' +
+                                                  re.escape(url + '/torrent'))
+            # Prefixes for plain concatenation on hot paths, str.format
+            # re-parses its template on every call
+            self.search_url = url + '/engine/search?'
+            self.download_url = url + '/engine/download_torrent?id='
         else:
             self.urls['login_check'] = None
             self.urls['search'] = None
             self.urls['torrent'] = None
             self.urls['url'] = None
+            self.torrent_href_regexp = None
+            self.search_url = None
+            self.download_url = None
             log.warning('{} is not a valid url'.format(self.conf('url')))
 
     def refreshLoginUrl(self):
@@ -77,7 +153,8 @@ class YGG(TorrentProvider, MovieProvider):
         accepted, http is not secure enough to use basic authentication.
         """
         self.last_login_check = False
-        matcher = re.search(YGG.url_regexp, self.conf('login_url'))
+        self.auth_epoch += 1
+        matcher = YGG.url_regexp.search(self.conf('login_url'))
         if matcher:
             login_url = matcher.group(1)
             log.debug('Refreshing login url with {}'.format(login_url))
@@ -110,7 +187,12 @@ class YGG(TorrentProvider, MovieProvider):
         .. seealso:: YarrProvider.loginSuccess
         """
         log.debug(output)
-        return len(output) == 0
+        result = len(output) == 0
+        if result:
+            # Pages fetched with the previous session are stale once a
+            # new one is opened
+            self.auth_epoch += 1
+        return result
 
     def loginCheckSuccess(self, output):
         """
@@ -123,8 +205,8 @@ class YGG(TorrentProvider, MovieProvider):
         .. seealso:: YarrProvider.loginCheckSuccess
         """
         result = False
-        soup = BeautifulSoup(output, 'html.parser')
-        if soup.find(text=u' Déconnexion'):
+        soup = BeautifulSoup(output, HTML_PARSER)
+        if soup.find('a', href=YGG.logout_regexp):
             result = True
         return result
 
@@ -136,14 +218,27 @@ class YGG(TorrentProvider, MovieProvider):
         :type nzb: dict
         .. seealso:: MovieSearcher.correctRelease
         """
-        data = self.getHTMLData(nzb['detail_url'])
-        soup = BeautifulSoup(data, 'html.parser')
+        data = nzb.pop('_detail_html', None)
+        if data is None:
+            data = self._cachedGet(nzb['detail_url'])
+        soup = BeautifulSoup(data, HTML_PARSER)
         description = soup.find(class_='description-header').find_next('div')
         if description:
-            nzb['description'] = description.prettify()
-        line = soup.find(text=u'Uploadé le').find_next('td')
-        added = datetime.strptime(line.getText().split('(')[0].strip(),
-                                  '%d/%m/%Y %H:%M')
+            # Keep the raw markup so IMDB ids inside link attributes
+            # stay visible to getImdb, prettify would re-walk and
+            # re-indent the whole subtree for nothing
+            nzb['description'] = str(description)
+        # Anchor the scan on the informations table rather than walking
+        # every text node of the document
+        infos = soup.find('table', class_='informations') or soup
+        line = infos.find(text=u'Uploadé le').find_next('td')
+        # Parse the fixed 'dd/mm/yyyy hh:mm' format by hand, strptime
+        # is much slower for no added value here
+        date, hour = line.getText().split('(')[0].split()
+        day, month, year = date.split('/')
+        hours, minutes = hour.split(':')
+        added = datetime(int(year), int(month), int(day), int(hours),
+                         int(minutes))
         nzb['age'] = (datetime.now() - added).days
         log.debug(nzb['age'])
 
@@ -160,10 +255,19 @@ class YGG(TorrentProvider, MovieProvider):
         .. seealso:: MovieSearcher.correctRelease
         """
         result = True
-        ids = getImdb(nzb.get('description', ''), multiple=True)
-        if len(ids) not in [0, 1]:
-            log.info('Too much IMDB ids: {}'.format(', '.join(ids)))
-            result = False
+        description = nzb.get('description', '')
+        if not description:
+            return result
+        # Stop scanning as soon as a second distinct IMDB id shows up,
+        # getImdb only runs to build the full list for the log message
+        ids = set()
+        for matcher in YGG.imdb_regexp.finditer(description):
+            ids.add(matcher.group())
+            if len(ids) > 1:
+                log.info('Too much IMDB ids: {}'.format(
+                    ', '.join(getImdb(description, multiple=True))))
+                result = False
+                break
         return result
 
     def buildUrl(self, title, offset):
@@ -177,20 +281,71 @@ class YGG(TorrentProvider, MovieProvider):
         :return: Searching URL
         :rtype: str
         """
-        params = {
-            'category': 2145,  # Film/Vidéo
-            'description': '',
-            'do': 'search',
-            'file': '',
-            'name': simplifyString(title),
-            'sub_category': 'all',
-            'uploader': ''
-        }
-        if offset > 0:
-            params['page'] = offset * YGG.limit
-        return self.urls['search'].format(tryUrlencode(params))
+        # Memoize the encoded query: pagination and repeated searches
+        # rebuild it for the same title again and again
+        key = (title, offset)
+        query = self.query_cache.pop(key, None)
+        if query is None:
+            params = {
+                'category': 2145,  # Film/Vidéo
+                'description': '',
+                'do': 'search',
+                'file': '',
+                'name': simplifyString(title),
+                'sub_category': 'all',
+                'uploader': ''
+            }
+            if offset > 0:
+                params['page'] = offset * YGG.limit
+            query = tryUrlencode(params)
+        self.query_cache[key] = query
+        while len(self.query_cache) > YGG.query_cache_size:
+            self.query_cache.popitem(last=False)
+        return self.search_url + query
 
-    def _searchOnTitle(self, title, media, quality, results, offset=0):
+    def hasNextPage(self, soup, offset):
+        """
+        Check if a page links to a next one through pagination.
+
+        :param soup: Parsed HTML body of a search page
+        :type soup: bs4.BeautifulSoup
+        :param offset: Current page index
+        :type offset: int
+        :return: The checking result
+        :rtype: bool
+        """
+        pagination = soup.find('ul', class_='pagination')
+        if pagination:
+            for page in pagination.find_all('li'):
+                if tryInt(page.find('a').get_text(strip=True)) > offset + 1:
+                    return True
+        return False
+
+    def _prefetchDetails(self, results):
+        """
+        Fetch detail pages of found torrents in parallel so that later
+        getMoreInfo calls don't pay one serial round trip each. Fetched
+        HTML is stashed on each result and picked up by getMoreInfo.
+
+        :param results: Torrents found by a search
+        :type results: list
+        """
+        if ThreadPoolExecutor is None or not results:
+            return
+        pool = ThreadPoolExecutor(max_workers=8)
+        try:
+            futures = [pool.submit(self._cachedGet, nzb['detail_url'])
+                       for nzb in results]
+            for nzb, future in zip(results, futures):
+                try:
+                    nzb['_detail_html'] = future.result()
+                except Exception as e:
+                    log.debug('Cannot prefetch {}: {}'.
+                              format(nzb['detail_url'], e))
+        finally:
+            pool.shutdown()
+
+    def _searchOnTitle(self, title, media, quality, results):
         """
         Do a search based on possible titles. This function doesn't check
         the quality because CouchPotato do the job when parsing results.
@@ -203,34 +358,54 @@ class YGG(TorrentProvider, MovieProvider):
         :type quality: dict
         :param results: Where to append finded torrents
         :type results: list
-        :param offset: Page index when pagination is on
-        :type offset: int
         .. seealso:: YarrProvider.search
         """
+        pool = None
+        if ThreadPoolExecutor is not None:
+            pool = ThreadPoolExecutor(max_workers=1)
         try:
-            data = self.getHTMLData(self.buildUrl(title, offset))
-            soup = BeautifulSoup(data, 'html.parser')
-            filter_ = '^{}'.format(self.urls['torrent'])
-            resultList = soup.find(class_='results')
-            if resultList:
-                for link in resultList.find_all(href=re.compile(filter_)):
+            # Bind hot loop lookups to locals, dict and attribute
+            # accesses add up over 50 rows per page
+            download_url = self.download_url
+            href_regexp = self.torrent_href_regexp
+            id_regexp = YGG.id_regexp
+            category_regexp = YGG.category_regexp
+            offset = 0
+            data = self._cachedGet(self.buildUrl(title, offset))
+            while True:
+                soup = BeautifulSoup(data, HTML_PARSER,
+                                     parse_only=SEARCH_STRAINER)
+                # Overlap the fetch of the next page with the row
+                # processing of the current one
+                next_page = self.hasNextPage(soup, offset)
+                future = None
+                if next_page and pool is not None:
+                    future = pool.submit(self._cachedGet,
+                                         self.buildUrl(title, offset + 1))
+                resultList = soup.find(class_='results')
+                if not resultList:
+                    break
+                for row in resultList.find_all('tr'):
+                    link = row.find('a', href=href_regexp)
+                    if not link:
+                        continue
                     detail_url = link['href']
-                    if re.search(u'/filmvidéo/(film|animation|documentaire)/',
-                                 detail_url):
-                        name = YGG.parseText(link)
-                        id_ = tryInt(re.search('/(\d+)-[^/\s]+$',
-                                     link['href']).group(1))
-                        columns = link.parent.parent.find_all('td')
-                        size = self.parseSize(YGG.parseText(columns[5]))
-                        seeders = tryInt(YGG.parseText(columns[7]))
-                        leechers = tryInt(YGG.parseText(columns[8]))
+                    if category_regexp.search(detail_url):
+                        name = link.get_text(strip=True)
+                        id_ = tryInt(id_regexp.search(link['href']).
+                                     group(1))
+                        columns = row.find_all('td', limit=9)
+                        size = self.parseSize(
+                            columns[5].get_text(strip=True))
+                        seeders = YGG.parseInt(columns[7])
+                        leechers = YGG.parseInt(columns[8])
                         result = {
                             'id': id_,
                             'name': name,
                             'seeders': seeders,
                             'leechers': leechers,
                             'size': size,
-                            'url': self.urls['url'].format(id_),
+                            'url': download_url + str(id_),
                             'detail_url': detail_url,
                             'verified': True,
                             'get_more_info': self.getMoreInfo,
@@ -239,14 +414,19 @@ class YGG(TorrentProvider, MovieProvider):
                         results.append(result)
                         log.debug(result)
                 # Get next page if we don't have all results
-                pagination = soup.find('ul', class_='pagination')
-                if pagination:
-                    for page in pagination.find_all('li'):
-                        next_ = tryInt(YGG.parseText(page.find('a')))
-                        if next_ > offset + 1:
-                            self._searchOnTitle(title, media, quality, results,
-                                                offset + 1)
-                            break
-        except:
+                if not next_page:
+                    break
+                offset += 1
+                if future is not None:
+                    data = future.result()
+                else:
+                    data = self._cachedGet(self.buildUrl(title, offset))
+            self._prefetchDetails(results)
+        except Exception as e:
             log.error('Failed searching release from {}: {}'.
-                      format(self.getName(), traceback.format_exc()))
+                      format(self.getName(), e))
+            if log.logger.isEnabledFor(logging.DEBUG):
+                log.debug(traceback.format_exc())
+        finally:
+            if pool is not None:
+                pool.shutdown()